@@ -1,12 +1,23 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 import re
+from bisect import bisect_right
+from collections import defaultdict
+from functools import lru_cache
+from itertools import chain
+from operator import itemgetter
+import ahocorasick
+import msgspec
 from datetime import datetime
 
-app = FastAPI()
+class MsgspecJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return msgspec.json.encode(content)
+
+app = FastAPI(default_response_class=MsgspecJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,46 +31,68 @@ app.add_middleware(
 async def preflight():
     return JSONResponse(status_code=200)
 
-class OCRRequest(BaseModel):
-    pages: List[Dict[str, Any]]
+class OCRPage(msgspec.Struct):
+    words: List[Dict[str, Any]] = []
+    tokens: List[Dict[str, Any]] = []
+
+class OCRRequest(msgspec.Struct):
+    pages: List[OCRPage]
+
+_AMOUNT_RE = re.compile(r"[\d,]+(?:\.\d{1,2})?")
+_DIGIT_RE = re.compile(r"[0-9]")
+_NON_NUMERIC_RE = re.compile(r"[^0-9,\.]")
+_QTY_RE = re.compile(r'\b(item|items|qty|no\.?|pcs|piece|item\(s\))\b', re.I)
+_DATE_PATTERNS = (
+    r"\b(\d{1,2}[-/\.\s][A-Za-z]{3}[-/\.\s]\d{2,4})\b",
+    r"\b(\d{1,2}[-/\.\s]\d{1,2}[-/\.\s]\d{2,4})\b",
+    r"\b(\d{4}[-/\.\s]\d{1,2}[-/\.\s]\d{1,2})\b",
+    r"\b(\d{1,2} [A-Za-z]{3,9} \d{2,4})\b",
+    r"\b([A-Za-z]{3,9} \d{1,2}, \d{4})\b"
+)
+_DATE_RES = tuple(re.compile(p) for p in _DATE_PATTERNS)
+# One pass that tells whether any date pattern can match a line at all.
+_ANY_DATE_RE = re.compile("|".join(f"(?:{p})" for p in _DATE_PATTERNS))
 
 def group_words_into_lines(words):
-    lines = []
-    current_line = []
-    prev_y = None
-
-    safe_words = []
+    buckets = defaultdict(list)
     for w in words:
         vertices = w.get("boundingPolygon", {}).get("normalizedVertices", [])
-        if vertices and "x" in vertices[0] and "y" in vertices[0]:
-            w["__y"] = round(vertices[0]["y"], 2)
-            w["__x"] = vertices[0]["x"]
-            safe_words.append(w)
-
-    sorted_words = sorted(safe_words, key=lambda w: (w["__y"], w["__x"]))
-
-    for word in sorted_words:
-        y = word["__y"]
-        if prev_y is None or abs(y - prev_y) < 0.01:
-            current_line.append(word["text"])
-        else:
-            lines.append(" ".join(current_line))
-            current_line = [word["text"]]
+        if not vertices:
+            continue
+        first = vertices[0]
+        if "x" in first and "y" in first:
+            buckets[round(first["y"], 2)].append((first["x"], w["text"]))
+
+    groups = []
+    current_line = []
+    prev_y = None
+    for y in sorted(buckets):
+        # Rounded rows closer than 0.01 (float noise) still share a line.
+        if prev_y is not None and abs(y - prev_y) >= 0.01:
+            groups.append(current_line)
+            current_line = []
+        row = buckets[y]
+        if len(row) > 1:
+            row.sort(key=itemgetter(0))
+        current_line += [text for _, text in row]
         prev_y = y
     if current_line:
-        lines.append(" ".join(current_line))
-    return lines
+        groups.append(current_line)
+    return [" ".join(g) for g in groups]
 
+@lru_cache(maxsize=4096)
 def _parse_amount_str(s: str):
     if not s:
         return None
-    s_clean = re.sub(r"[₹$€£]|INR|USD|EUR|GBP", "", s, flags=re.IGNORECASE)
-    s_clean = re.sub(r"(?<=\d)\s+(?=\d)", "", s_clean)
-    s_clean = re.sub(r"[^0-9,\.]", "", s_clean)
-    s_clean = s_clean.replace(",", "")
-    if s_clean.count(".") > 1:
-        parts = s_clean.split(".")
-        s_clean = "".join(parts[:-1]) + "." + parts[-1]
+    s_clean = s.replace(",", "")
+    # Plain ASCII digits with at most one dot (what _AMOUNT_RE yields) need no stripping.
+    if not (s_clean.isascii() and s_clean.replace(".", "", 1).isdigit()):
+        # Currency markers and spaces are non-numeric too, so one pass strips them all.
+        s_clean = _NON_NUMERIC_RE.sub("", s)
+        s_clean = s_clean.replace(",", "")
+        if s_clean.count(".") > 1:
+            parts = s_clean.split(".")
+            s_clean = "".join(parts[:-1]) + "." + parts[-1]
     try:
         val = float(s_clean)
         if val <= 0 or val > 10_000_000:
@@ -68,84 +101,143 @@ def _parse_amount_str(s: str):
     except:
         return None
 
-def extract_total_amount(lines: List[str], full_text_upper="") -> float:
-    prioritized_keywords = [
-        "grand total",
-        "amount payable",
-        "amount to be paid",
-        "net payable",
-        "total payable",
-        "total amount",
-        "balance due",
-        "total bill amount",
-        "bill amount",
-        "amount payable from customer",
-        "upi payment",
-        "net amt",
-        "net amount",
-        "total",
-    ]
+_TOTAL_KEYWORDS = (
+    "grand total",
+    "amount payable",
+    "amount to be paid",
+    "net payable",
+    "total payable",
+    "total amount",
+    "balance due",
+    "total bill amount",
+    "bill amount",
+    "amount payable from customer",
+    "upi payment",
+    "net amt",
+    "net amount",
+    "total",
+)
 
+_EXCLUDE_TOKENS = ("sub total", "subtotal", "cgst", "sgst", "vat", "tax", "taxes", "discount", "change")
+_INVOICE_KEYWORDS = ("invoice", "inv no", "bill no", "receipt no", "voucher")
+
+_TOTAL, _EXCLUDE, _INVOICE = 0, 1, 2
+
+def _build_automaton(*tables):
+    automaton = ahocorasick.Automaton()
+    for kind, table in enumerate(tables):
+        for priority, (_, keywords) in enumerate(table):
+            for kw in keywords:
+                if kw not in automaton:
+                    automaton.add_word(kw, (kind, priority))
+                elif automaton.get(kw)[0] != kind:
+                    # One value per keyword: a keyword shared by two tables would lose a kind.
+                    raise ValueError(f"Keyword {kw!r} appears in more than one table")
+    automaton.make_automaton()
+    return automaton
+
+def _build_line_automaton(total_keywords, exclude_tokens, invoice_keywords):
+    # Each keyword maps to (total priority or None, kinds), so a token listed in
+    # several tables keeps every role it has.
+    entries = {}
+    for priority, kw in enumerate(total_keywords):
+        entries.setdefault(kw, [priority, set()])[1].add(_TOTAL)
+    for kind, table in ((_EXCLUDE, exclude_tokens), (_INVOICE, invoice_keywords)):
+        for kw in table:
+            entries.setdefault(kw, [None, set()])[1].add(kind)
+
+    automaton = ahocorasick.Automaton()
+    for kw, (priority, kinds) in entries.items():
+        automaton.add_word(kw, (priority, frozenset(kinds)))
+    automaton.make_automaton()
+    return automaton
+
+_LINE_AUTOMATON = _build_line_automaton(_TOTAL_KEYWORDS, _EXCLUDE_TOKENS, _INVOICE_KEYWORDS)
+
+def extract_total_amount(lines: List[str], full_text_upper="", lowered: Optional[List[str]] = None) -> float:
     normalized = [ln for ln in lines]
+    if lowered is None:
+        lowered = [ln.lower() for ln in normalized]
     n_lines = len(normalized)
-    amount_pattern = re.compile(r"[\d,]+(?:\.\d{1,2})?")
-
-    def amounts_in_line(line: str):
-        found = amount_pattern.findall(line.replace(" ", ""))
-        parsed = [_parse_amount_str(f) for f in found]
-        return [p for p in parsed if p is not None]
-
-    qty_re = re.compile(r'\b(item|items|qty|no\.?|pcs|piece|item\(s\))\b', re.I)
-    invoice_keywords = ["invoice", "inv no", "bill no", "receipt no", "voucher"]
-
-    for kw in prioritized_keywords:
-        for idx, line in enumerate(normalized):
-            low = line.lower()
-            if kw in low and "sub" not in low:
-                neighbor_idxs = [idx, idx - 1, idx + 1]
-                neighbor_cands = []
-                for j in neighbor_idxs:
-                    if 0 <= j < n_lines:
-                        if any(tok in normalized[j].lower() for tok in invoice_keywords):
-                            continue  # skip invoice number lines
-                        cands = amounts_in_line(normalized[j])
-                        for a in cands:
-                            neighbor_cands.append((a, j, normalized[j]))
-
-                if not neighbor_cands:
-                    continue
-
-                filtered = []
-                for a, j, l in neighbor_cands:
-                    if qty_re.search(l) and float(a).is_integer():
-                        continue
-                    filtered.append((a, j, l))
-
-                if filtered:
-                    def _score(t):
-                        a, j, l = t
-                        score = 0
-                        if '.' in str(a):
-                            score += 2
-                        if j > n_lines * 0.6:
-                            score += 1
-                        score += (a / (1 + a))
-                        return (score, a)
-                    best = max(filtered, key=_score)
-                    return best[0]
-
-                return max(a for a, _, _ in neighbor_cands)
+
+    # Parsed amounts per line index, shared by the keyword and fallback passes.
+    line_amounts = [None] * n_lines
+
+    def amounts_in_line(idx: int):
+        if line_amounts[idx] is None:
+            line = normalized[idx]
+            if not _DIGIT_RE.search(line):
+                # Nothing without an ASCII digit can parse to a positive amount.
+                line_amounts[idx] = []
+            else:
+                found = _AMOUNT_RE.findall(line.replace(" ", ""))
+                parsed = [_parse_amount_str(f) for f in found]
+                line_amounts[idx] = [p for p in parsed if p is not None]
+        return line_amounts[idx]
+
+    # One automaton pass over the whole receipt: each line's best total keyword,
+    # plus the lines carrying exclude or invoice-number tokens.
+    line_starts = []
+    pos = 0
+    for low in lowered:
+        line_starts.append(pos)
+        pos += len(low) + 1
+    line_priority = {}
+    excluded_lines = set()
+    invoice_lines = set()
+    for end, (priority, kinds) in _LINE_AUTOMATON.iter("\n".join(lowered)):
+        idx = bisect_right(line_starts, end) - 1
+        if _TOTAL in kinds and priority < line_priority.get(idx, len(_TOTAL_KEYWORDS)):
+            line_priority[idx] = priority
+        if _EXCLUDE in kinds:
+            excluded_lines.add(idx)
+        if _INVOICE in kinds:
+            invoice_lines.add(idx)
+    keyword_lines = sorted((priority, idx) for idx, priority in line_priority.items() if "sub" not in lowered[idx])
+
+    for _, idx in keyword_lines:
+        neighbor_idxs = [idx, idx - 1, idx + 1]
+        neighbor_cands = []
+        for j in neighbor_idxs:
+            if 0 <= j < n_lines:
+                if j in invoice_lines:
+                    continue  # skip invoice number lines
+                cands = amounts_in_line(j)
+                for a in cands:
+                    neighbor_cands.append((a, j, normalized[j]))
+
+        if not neighbor_cands:
+            continue
+
+        filtered = []
+        for a, j, l in neighbor_cands:
+            if _QTY_RE.search(l) and float(a).is_integer():
+                continue
+            filtered.append((a, j, l))
+
+        if filtered:
+            def _score(t):
+                a, j, l = t
+                score = 0
+                if '.' in str(a):
+                    score += 2
+                if j > n_lines * 0.6:
+                    score += 1
+                score += (a / (1 + a))
+                return (score, a)
+            best = max(filtered, key=_score)
+            return best[0]
+
+        return max(a for a, _, _ in neighbor_cands)
 
     # Collect candidates excluding known non-totals
-    exclude_tokens = ["sub total", "subtotal", "cgst", "sgst", "vat", "tax", "taxes", "discount", "change"]
     candidates = []
     for idx, line in enumerate(normalized):
-        low = line.lower()
-        if any(tok in low for tok in exclude_tokens):
+        if idx in excluded_lines:
             continue
-        if any(tok in low for tok in invoice_keywords):
+        if idx in invoice_lines:
             continue  # skip invoice numbers
-        cands = amounts_in_line(line)
+        cands = amounts_in_line(idx)
         for c in cands:
             candidates.append((c, line, idx))
 
@@ -159,13 +251,13 @@ def extract_total_amount(lines: List[str], full_text_upper="") -> float:
         if fuel_candidates:
             return fuel_candidates[-1]  # pick last valid fuel amount
 
-    picked = max([c for c, _, _ in candidates])
+    picked = max(c for c, _, _ in candidates)
 
-    if picked < 10 or picked < (max([c for c, _, _ in candidates]) * 0.2):
+    if picked < 10:
         scored = []
         for amount, line, idx in candidates:
             score = 0
-            low = line.lower()
+            low = lowered[idx]
             if any(k in low for k in ["total", "amount", "due", "payable", "bill", "net"]):
                 score += 5
             if "net" in low or "payable" in low:
@@ -181,50 +273,63 @@ def extract_total_amount(lines: List[str], full_text_upper="") -> float:
 
     return picked
 
-def extract_date_from_text(lines):
-    date_patterns = [
-        r"\b(\d{1,2}[-/\.\s][A-Za-z]{3}[-/\.\s]\d{2,4})\b",
-        r"\b(\d{1,2}[-/\.\s]\d{1,2}[-/\.\s]\d{2,4})\b",
-        r"\b(\d{4}[-/\.\s]\d{1,2}[-/\.\s]\d{1,2})\b",
-        r"\b(\d{1,2} [A-Za-z]{3,9} \d{2,4})\b",
-        r"\b([A-Za-z]{3,9} \d{1,2}, \d{4})\b"
-    ]
-
-    def parse_date_safe(date_str):
-        formats = [
-            "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y-%m-%d",
-            "%d %B %Y", "%B %d, %Y", "%d/%m/%y", "%d-%m-%y",
-            "%d-%b-%Y", "%d-%b-%y"
-        ]
-        for fmt in formats:
-            try:
-                dt = datetime.strptime(date_str, fmt)
-                if dt.year < 2000:
-                    dt = dt.replace(year=dt.year + 100)
-                if 2010 <= dt.year <= datetime.now().year + 1:
-                    return dt.strftime("%Y-%m-%d")
-            except:
-                continue
+# (format, literal separator it needs, whether it needs a month name).
+# Formats whose shape can't fit the candidate are skipped without calling strptime.
+_DATE_FORMATS = (
+    ("%d/%m/%Y", "/", False), ("%d-%m-%Y", "-", False), ("%d.%m.%Y", ".", False), ("%Y-%m-%d", "-", False),
+    ("%d %B %Y", "", True), ("%B %d, %Y", ",", True), ("%d/%m/%y", "/", False), ("%d-%m-%y", "-", False),
+    ("%d-%b-%Y", "-", True), ("%d-%b-%y", "-", True)
+)
+
+@lru_cache(maxsize=1024)
+def _parse_date_safe(date_str: str, max_year: int):
+    has_alpha = any(c.isalpha() for c in date_str)
+    for fmt, sep, needs_alpha in _DATE_FORMATS:
+        if needs_alpha != has_alpha or sep not in date_str:
+            continue
+        try:
+            dt = datetime.strptime(date_str, fmt)
+            if dt.year < 2000:
+                dt = dt.replace(year=dt.year + 100)
+            if 2010 <= dt.year <= max_year:
+                return dt.strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+_DATE_CONTEXT_KEYWORDS = (
+    "invoice date", "bill date", "payment date", "txn date",
+    "transaction date", "paid on", "date of payment", "date"
+)
+
+def _first_date_in_line(line, max_year):
+    if not _ANY_DATE_RE.search(line):
         return None
+    for pattern in _DATE_RES:
+        for match in pattern.findall(line):
+            parsed = _parse_date_safe(match, max_year)
+            if parsed:
+                return parsed
+    return None
+
+def extract_date_from_text(lines, lowered=None):
+    max_year = datetime.now().year + 1
+    if lowered is None:
+        lowered = [ln.lower() for ln in lines]
+
+    # A date on a labelled line wins; only parse the other lines if none has one.
+    for line, low in zip(lines, lowered):
+        if any(k in low for k in _DATE_CONTEXT_KEYWORDS):
+            parsed = _first_date_in_line(line, max_year)
+            if parsed:
+                return parsed
 
-    valid_dates = []
     for line in lines:
-        for pattern in date_patterns:
-            matches = re.findall(pattern, line)
-            for match in matches:
-                parsed = parse_date_safe(match)
-                if parsed:
-                    valid_dates.append((parsed, line.lower()))
-
-    keywords = [
-        "invoice date", "bill date", "payment date", "txn date",
-        "transaction date", "paid on", "date of payment", "date"
-    ]
-    for date, context in valid_dates:
-        if any(k in context for k in keywords):
-            return date
-
-    return valid_dates[0][0] if valid_dates else "Not Found"
+        parsed = _first_date_in_line(line, max_year)
+        if parsed:
+            return parsed
+
+    return "Not Found"
 
 def get_safe_date(date_str: str):
     try:
@@ -235,111 +340,106 @@ def get_safe_date(date_str: str):
     except:
         return datetime.today().strftime("%Y-%m-%d")
 
+# Checked in order: the first category with a keyword in the text wins.
+_PURPOSE_KEYWORDS = (
+    ("Supplies", ("DMART", "BIG BAZAAR", "RELIANCE", "METRO", "SHOPPER STOP", "LIFESTYLE", "RELIANCE TRENDS")),
+    ("Shopping", ("AMAZON", "FLIPKART", "MYNTRA", "AJIO")),
+    ("Air", ("AIRLINES", "FLIGHT", "AIR TICKET", "BOARDING PASS", "INDIGO", "SPICEJET", "VISTARA", "GOFIRST", "AKASA", "EMIRATES", "QATAR AIRWAYS", "JET", "AIRPORT")),
+    ("Taxi", ("CAB", "TAXI", "AUTO", "RIDE", "OLA", "UBER", "RAPIDO", "MERU", "CNG RICKSHAW")),
+    ("Car Rental", ("CAR RENTAL", "ZOOMCAR", "REVV", "HERTZ", "AVIS", "ENTERPRISE RENTAL", "SELF DRIVE", "VEHICLE HIRE")),
+    ("Parking", ("PARKING", "TOLL", "GARAGE", "CAR PARK", "VEHICLE PARKING", "MALL PARKING", "HIGHWAY PARKING")),
+    ("Fuel", ("FUEL", "PETROL", "DIESEL", "GAS STATION", "HP", "INDIANOIL", "BPCL", "SHELL", "REFUEL")),
+    ("Hotel", ("ROOM NO", "RESORT", "LODGE", "INN", "INN TIME","OUT TIME","MOTEL", "SUITE", "ROOM CHARGE", "STAY", "ACCOMMODATION", "GUEST HOUSE", "BOOKING.COM", "EXPEDIA", "MAKEMYTRIP")),
+    ("Entertainment", ("MOVIE", "CINEMA", "THEATRE", "PVR", "INOX", "BOOKMYSHOW", "NETFLIX", "PRIME", "HOTSTAR", "SPOTIFY", "CONCERT", "EVENT", "SHOW", "GAMING", "SHOPPING", "MALL", "FASHION", "CLOTHES", "GARMENTS", "FOOTWEAR")),
+    ("Supplies", ("STATIONERY", "OFFICE SUPPLY", "PENS", "PRINTER", "CARTRIDGE", "INK", "TONER", "PAPER", "DIARY", "REGISTER", "FILE", "MARKER", "WHITEBOARD", "LAPTOP", "DESKTOP", "MONITOR", "KEYBOARD", "MOUSE", "SCANNER", "HEADPHONES", "EARPHONES", "SPEAKER", "CHARGER", "BATTERY", "ROUTER", "USB", "SSD", "HDD", "MOBILE", "TABLET", "CABLES", "PROJECTOR", "CAMERA", "ELECTRONIC BILL", "ELECTRONIC INVOICE")),
+    ("Miscellaneous", ("HOSPITAL", "PHARMACY", "DOCTOR", "CLINIC", "SURGERY", "MEDICINE", "TABLET", "INJECTION", "LAB", "DIAGNOSTIC", "PATHOLOGY", "XRAY", "SCAN", "MRI", "CHEMIST")),
+    ("Lunch", ("MORNING MEAL", "TEA", "COFFEE", "SNACKS", "CAFE", "IDLI", "DOSA", "POHA", "BREAD",
+               "MILK", "JUICE", "PANCAKE", "OMELETTE", "BREAKFAST", "BREAKFAST COMBO",
+               "THALI", "MEAL", "MIDDAY", "CAFETERIA", "BUFFET", "VEG", "NON-VEG", "LUNCH BOX",
+               "RESTAURANT BILL", "SUBWAY", "KFC", "PIZZA HUT", "DOMINOS")),
+    ("Dinner", ("SUPPER", "NIGHT MEAL", "DINNER BUFFET", "RESTAURANT", "EVENING MEAL", "DINNER COMBO",
+                "FINE DINE", "FOOD COURT", "ZOMATO","SWIGGY")),
+)
+
+_CURRENCY_TOKENS = (
+    ("INR", ("INR", "₹", "RS")),
+    ("USD", ("USD", "$")),
+    ("EUR", ("EUR", "€")),
+)
+
+_PURPOSE, _CURRENCY = 0, 1
+
+_KEYWORD_AUTOMATON = _build_automaton(_PURPOSE_KEYWORDS, _CURRENCY_TOKENS)
+
 def detect_purpose(text, expense_date=None):
-    text_upper = text.upper()
-
-    store_keywords = {
-        "Supplies": ["DMART", "BIG BAZAAR", "RELIANCE", "METRO", "SHOPPER STOP", "LIFESTYLE", "RELIANCE TRENDS"],
-        "Shopping": ["AMAZON", "FLIPKART", "MYNTRA", "AJIO"]
-    }
-    for category, keywords in store_keywords.items():
-        if any(k in text_upper for k in keywords):
-            return category
-
-    if any(k in text_upper for k in ["AIRLINES", "FLIGHT", "AIR TICKET", "BOARDING PASS", "INDIGO", "SPICEJET", "VISTARA", "GOFIRST", "AKASA", "EMIRATES", "QATAR AIRWAYS", "JET", "AIRPORT"]):
-        return "Air"
-    if any(k in text_upper for k in ["CAB", "TAXI", "AUTO", "RIDE", "OLA", "UBER", "RAPIDO", "MERU", "CNG RICKSHAW"]):
-        return "Taxi"
-    if any(k in text_upper for k in ["CAR RENTAL", "ZOOMCAR", "REVV", "HERTZ", "AVIS", "ENTERPRISE RENTAL", "SELF DRIVE", "VEHICLE HIRE"]):
-        return "Car Rental"
-    if any(k in text_upper for k in ["PARKING", "TOLL", "GARAGE", "CAR PARK", "VEHICLE PARKING", "MALL PARKING", "HIGHWAY PARKING"]):
-        return "Parking"
-    if any(k in text_upper for k in ["FUEL", "PETROL", "DIESEL", "GAS STATION", "HP", "INDIANOIL", "BPCL", "SHELL", "REFUEL"]):
-        return "Fuel"
-
-    if any(k in text_upper for k in ["ROOM NO", "RESORT", "LODGE", "INN", "INN TIME","OUT TIME","MOTEL", "SUITE", "ROOM CHARGE", "STAY", "ACCOMMODATION", "GUEST HOUSE", "BOOKING.COM", "EXPEDIA", "MAKEMYTRIP"]):
-        return "Hotel"
-
-    if any(k in text_upper for k in ["MOVIE", "CINEMA", "THEATRE", "PVR", "INOX", "BOOKMYSHOW", "NETFLIX", "PRIME", "HOTSTAR", "SPOTIFY", "CONCERT", "EVENT", "SHOW", "GAMING", "SHOPPING", "MALL", "FASHION", "CLOTHES", "GARMENTS", "FOOTWEAR"]):
-        return "Entertainment"
-
-    if any(k in text_upper for k in ["STATIONERY", "OFFICE SUPPLY", "PENS", "PRINTER", "CARTRIDGE", "INK", "TONER", "PAPER", "DIARY", "REGISTER", "FILE", "MARKER", "WHITEBOARD", "LAPTOP", "DESKTOP", "MONITOR", "KEYBOARD", "MOUSE", "SCANNER", "HEADPHONES", "EARPHONES", "SPEAKER", "CHARGER", "BATTERY", "ROUTER", "USB", "SSD", "HDD", "MOBILE", "TABLET", "CABLES", "PROJECTOR", "CAMERA", "ELECTRONIC BILL", "ELECTRONIC INVOICE"]):
-        return "Supplies"
-    if any(k in text_upper for k in ["HOSPITAL", "PHARMACY", "DOCTOR", "CLINIC", "SURGERY", "MEDICINE", "TABLET", "INJECTION", "LAB", "DIAGNOSTIC", "PATHOLOGY", "XRAY", "SCAN", "MRI", "CHEMIST"]):
-        return "Miscellaneous"
-
-    meal_keywords = {
-        "Lunch": ["MORNING MEAL", "TEA", "COFFEE", "SNACKS", "CAFE", "IDLI", "DOSA", "POHA", "BREAD",
-                  "MILK", "JUICE", "PANCAKE", "OMELETTE", "BREAKFAST", "BREAKFAST COMBO",
-                  "THALI", "MEAL", "MIDDAY", "CAFETERIA", "BUFFET", "VEG", "NON-VEG", "LUNCH BOX",
-                  "RESTAURANT BILL", "SUBWAY", "KFC", "PIZZA HUT", "DOMINOS"],
-        "Dinner": ["SUPPER", "NIGHT MEAL", "DINNER BUFFET", "RESTAURANT", "EVENING MEAL", "DINNER COMBO",
-                   "FINE DINE", "FOOD COURT", "ZOMATO","SWIGGY", "SWIGGY"]
-    }
+    purpose, _ = detect_purpose_and_currency(text.upper(), expense_date)
+    return purpose
+
+def detect_purpose_and_currency(text_upper, expense_date=None):
+    best = [None, None]
+    for _, (kind, priority) in _KEYWORD_AUTOMATON.iter(text_upper):
+        if best[kind] is None or priority < best[kind]:
+            best[kind] = priority
+            if best[_PURPOSE] == 0 and best[_CURRENCY] == 0:
+                break
+
+    purpose_best, currency_best = best
+    currency = _CURRENCY_TOKENS[currency_best][0] if currency_best is not None else "INR"
+    if purpose_best is not None:
+        return _PURPOSE_KEYWORDS[purpose_best][0], currency
 
     meal_by_time = None
     if expense_date and expense_date != "Not Found":
         try:
-            try:
-                dt = datetime.strptime(expense_date, "%Y-%m-%d %H:%M:%S")
-            except:
-                dt = datetime.strptime(expense_date, "%Y-%m-%d")
+            # Only the timestamp format has colons, so this picks the one that can match.
+            fmt = "%Y-%m-%d %H:%M:%S" if ":" in expense_date else "%Y-%m-%d"
+            dt = datetime.strptime(expense_date, fmt)
             hour = dt.hour
             if hour < 17:
                 meal_by_time = "Lunch"
             else:
                 meal_by_time = "Dinner"
-        except:
+        except (ValueError, TypeError):
             pass
 
-    for meal, keywords in meal_keywords.items():
-        if any(k in text_upper for k in keywords):
-            return meal
-
     if "RESTAURANT" in text_upper or "FOOD" in text_upper or "MEAL" in text_upper:
         if meal_by_time:
-            return meal_by_time
-        return "Lunch"
+            return meal_by_time, currency
+        return "Lunch", currency
 
     if meal_by_time:
-        return meal_by_time
+        return meal_by_time, currency
 
-    return "Miscellaneous"
+    return "Miscellaneous", currency
+
+def _extract_expense_info(body: bytes):
+    try:
+        payload = msgspec.json.decode(body, type=OCRRequest)
+    except msgspec.DecodeError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=422)
 
-@app.post("/extract-expense-info")
-async def extract_expense_info(payload: OCRRequest):
     try:
-        words = []
-        for page in payload.pages:
-            words.extend(page.get("words", []))
+        words = list(chain.from_iterable(page.words for page in payload.pages))
 
         if not words:
-            for page in payload.pages:
-                words.extend(page.get("tokens", []))
+            words = list(chain.from_iterable(page.tokens for page in payload.pages))
             if not words:
                 return JSONResponse(content={"error": "No OCR words or tokens found."}, status_code=400)
 
         lines = group_words_into_lines(words)
-        full_text_upper = " ".join([w.get("text", "").upper() for w in words])
+        lowered = [ln.lower() for ln in lines]
+        full_text_upper = " ".join([w.get("text", "") for w in words]).upper()
 
-        total = extract_total_amount(lines, full_text_upper)
+        total = extract_total_amount(lines, full_text_upper, lowered)
 
-        raw_expense_date = extract_date_from_text(lines)
+        raw_expense_date = extract_date_from_text(lines, lowered)
         expense_date = get_safe_date(raw_expense_date)
-
-        if any(cur in full_text_upper for cur in ["INR", "₹", "RS"]):
-            currency = "INR"
-        elif any(cur in full_text_upper for cur in ["USD", "$"]):
-            currency = "USD"
-        elif any(cur in full_text_upper for cur in ["EUR", "€"]):
-            currency = "EUR"
-        else:
-            currency = "INR"
+        purpose, currency = detect_purpose_and_currency(full_text_upper, expense_date)
 
         return {
             "ReimbursementCurrencyCode": currency,
             "ExpenseReportTotal": f"{total:.2f}",
-            "Purpose": detect_purpose(full_text_upper, expense_date),
+            "Purpose": purpose,
             "ExpenseDate": expense_date,
             "SubmitReport": "Y"
         }
@@ -347,8 +447,7 @@ async def extract_expense_info(payload: OCRRequest):
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
-
-
-
-
-
+@app.post("/extract-expense-info")
+async def extract_expense_info(request: Request):
+    # Parsing and extraction are CPU-bound; keep them off the event loop.
+    return await run_in_threadpool(_extract_expense_info, await request.body())